@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# cython: language_level=3
+# -----------------------------------------------------------------------------
+# This file is part of the Augsburg Crazyflie Project.
+# (C) 2023 Hochschule Augsburg, University of Applied Sciences
+# -----------------------------------------------------------------------------
+#
+# Company:        University of Applied Sciences, Augsburg, Germany
+#
+# Description:    Compiled CRTP wire codec for the simulation link driver.
+#
+# --------------------- LICENSE -----------------------------------------------
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program; if not, see <http://www.gnu.org/licenses/>
+# or write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+# -----------------------------------------------------------------------------
+"""
+Compiled versions of the CRTP wire codec used by cflib.crtp.simdriver.
+
+A packet on the IPC link is laid out as size(1) | header(1) | data(size),
+on the message queue it is prefixed by the IPC port(1).
+The pure Python fallbacks in simdriver produce the same bytes and raise
+the same ValueError for a header or size that does not fit a byte.
+"""
+from cpython.bytes cimport PyBytes_AS_STRING
+from cpython.bytes cimport PyBytes_FromStringAndSize
+from libc.string cimport memcpy
+
+
+cdef inline bytes _pack(Py_ssize_t offset, int header, const unsigned char[::1] data):
+    """Serialize a CRTP header and payload, leaving offset bytes in front"""
+    cdef Py_ssize_t size = data.shape[0]
+    cdef bytes packet
+    cdef char *buf
+
+    if not 0 <= header <= 255 or size > 255:
+        raise ValueError('CRTP header {} or size {} out of range'.format(header, size))
+    packet = PyBytes_FromStringAndSize(NULL, offset + size + 2)
+    buf = PyBytes_AS_STRING(packet) + offset
+
+    buf[0] = <char>size
+    buf[1] = <char>header
+    if size:
+        memcpy(buf + 2, &data[0], size)
+    return packet
+
+
+cpdef bytes pack_crtp(int header, const unsigned char[::1] data):
+    """Serialize a CRTP header and payload"""
+    return _pack(0, header, data)
+
+
+cpdef bytes pack_ipc_crtp(int port, int header, const unsigned char[::1] data):
+    """Serialize a CRTP header and payload prefixed by the IPC port"""
+    cdef bytes packet
+
+    if not 0 <= port <= 255:
+        raise ValueError('IPC port {} out of range'.format(port))
+    packet = _pack(1, header, data)
+    PyBytes_AS_STRING(packet)[0] = <char>port
+    return packet
+
+
+cpdef tuple unpack_crtp(const unsigned char[::1] buf):
+    """Return the header and payload of a serialized CRTP packet"""
+    cdef Py_ssize_t size = buf[0]
+    cdef unsigned char header = buf[1]
+
+    # Never read past the end of a truncated packet
+    if size > buf.shape[0] - 2:
+        size = buf.shape[0] - 2
+    return header, PyBytes_FromStringAndSize(<const char *>&buf[0] + 2, size)
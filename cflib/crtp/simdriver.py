@@ -33,11 +33,15 @@ This driver is used to communicate with an emulated Crazyflie in
 ROS2 Gazebo sim_cf2 software-in-the-loop simulation.
 """
 import logging
+import mmap
+import os
 import queue
+import selectors
 import struct
+import time
 import posix_ipc
 from threading import Thread
-from multiprocessing import Queue
+from threading import local
 
 from cflib.utils.callbacks import Caller
 from cflib.crtp.crtpstack import CRTPPacket
@@ -49,6 +53,59 @@ __all__ = ['SimDriver']
 logger = logging.getLogger(__name__)
 
 PORT_IPC_CRTP = 0x0
+# Never has callbacks, only used to wake up the rx thread on shutdown
+PORT_IPC_WAKEUP = 0xFF
+
+# Wire layout of a CRTP packet on the IPC link: size(1) + header(1) + payload
+_HDR2 = struct.Struct('<BB')
+_I_STRUCT = struct.Struct('<I')
+
+# Per thread scratch buffer, the packet is built in place and copied
+# out once instead of concatenating intermediate objects
+_packScratch = local()
+
+
+def _packCrtpInto(offset, header, data):
+    """Serialize a CRTP packet into the scratch buffer at offset, returns
+    the buffer and the end of the packet in it"""
+    buf = getattr(_packScratch, 'buf', None)
+    if buf is None:
+        buf = _packScratch.buf = bytearray(3 + CRTPPacket.MAX_DATA_SIZE)
+    size = len(data)
+    try:
+        _HDR2.pack_into(buf, offset, size, header)
+    except struct.error:
+        raise ValueError('CRTP header {} or size {} out of range'.format(header, size))
+    buf[offset + 2:offset + 2 + size] = data
+    return buf, offset + 2 + size
+
+
+def _pack_crtp_python(header, data):
+    """Serialize a CRTP header and payload"""
+    buf, end = _packCrtpInto(0, header, data)
+    return bytes(memoryview(buf)[:end])
+
+
+def _pack_ipc_crtp_python(port, header, data):
+    """Serialize a CRTP header and payload prefixed by the IPC port"""
+    buf, end = _packCrtpInto(1, header, data)
+    buf[0] = port
+    return bytes(memoryview(buf)[:end])
+
+
+def _unpack_crtp_python(buf):
+    """Return the header and payload of a serialized CRTP packet"""
+    return buf[1], bytes(buf[2:buf[0] + 2])
+
+
+# Use the compiled codec if it was built, see _simcodec.pyx
+try:
+    from cflib.crtp._simcodec import pack_crtp, pack_ipc_crtp, unpack_crtp
+except ImportError:
+    pack_crtp = _pack_crtp_python
+    pack_ipc_crtp = _pack_ipc_crtp_python
+    unpack_crtp = _unpack_crtp_python
+
 
 linkUris = {
     0xE7E7E7E701:'radio://0/80/2M/E7E7E7E701',
@@ -63,6 +120,52 @@ linkUris = {
     0xE7E7E7E70A:'radio://0/80/2M/E7E7E7E70A'
 }
 
+
+def _ipcNames(uri, kind):
+    '''Return the (rx, tx) names of the IPC objects for a link uri,
+    kind is "mq" for message queues or "shm" for shared memory rings'''
+    return f"/rxsimcrtp{kind}{uri[-2:]}", f"/txsimcrtp{kind}{uri[-2:]}"
+
+
+# Message queue names of the known links, so connect does not rebuild them
+_uriQueueNames = {uri: _ipcNames(uri, 'mq') for uri in linkUris.values()}
+
+
+def _configureRxThread():
+    '''Apply the optional CPU pinning and real-time priority to the calling
+    rx thread, set with SIMDRIVER_RX_CORE=<core> and
+    SIMDRIVER_SCHED_FIFO=<priority>. Raising the priority needs
+    CAP_SYS_NICE.'''
+    rxCore = os.getenv('SIMDRIVER_RX_CORE')
+    if rxCore is not None:
+        try:
+            os.sched_setaffinity(0, {int(rxCore)})
+        except (ValueError, OSError) as e:
+            logger.warning('Could not pin sim driver rx thread to core {}: {}'.format(rxCore, e))
+
+    fifoPriority = os.getenv('SIMDRIVER_SCHED_FIFO')
+    if fifoPriority is not None:
+        try:
+            os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(int(fifoPriority)))
+        except (ValueError, OSError) as e:
+            logger.warning('Could not set SCHED_FIFO priority {} for sim driver rx thread: {}'
+                           .format(fifoPriority, e))
+
+
+def _busyPollNs():
+    '''Time in ns the rx threads spin on non-blocking receives before they
+    block, set with SIMDRIVER_BUSY_POLL_US=<microseconds>. Disabled by
+    default since it keeps a core busy.'''
+    busyPollUs = os.getenv('SIMDRIVER_BUSY_POLL_US')
+    if not busyPollUs:
+        return 0
+    try:
+        return max(int(busyPollUs), 0) * 1000
+    except ValueError:
+        logger.warning('Invalid SIMDRIVER_BUSY_POLL_US {}, busy polling disabled'.format(busyPollUs))
+        return 0
+
+
 class SimDriver(CRTPDriver):
     """ Simulation link driver """
 
@@ -93,15 +196,17 @@ class SimDriver(CRTPDriver):
         # Inter-thread communication
         self._in_queue = queue.Queue()
 
-        # Inter-process communication
-        rxIpcQueueName = "/rxsimcrtpmq" + uri[-2:]
-        txIpcQueueName = "/txsimcrtpmq" + uri[-2:]
-        # print(f"rxIpcQueueName {rxIpcQueueName} txIpcQueueName {txIpcQueueName}")
-        self.crtpCom = SimulationIpcPosix(rxIpcQueueName, txIpcQueueName)
-        self.crtpCom.incomingCrtpPacket.add_callback(self._receive_packet_posix_mq)
-
-    def _receive_packet_posix_mq(self, crtp_packet):
-        self._in_queue.put(crtp_packet)
+        # Inter-process communication, POSIX message queues unless the
+        # shared memory ring is requested with SIMDRIVER_IPC=shm
+        if os.getenv('SIMDRIVER_IPC') == 'shm':
+            rxIpcShmName, txIpcShmName = _ipcNames(uri, 'shm')
+            self.crtpCom = SimulationIpcShm(rxIpcShmName, txIpcShmName)
+        else:
+            rxIpcQueueName, txIpcQueueName = _uriQueueNames.get(uri) or _ipcNames(uri, 'mq')
+            self.crtpCom = SimulationIpcPosix(rxIpcQueueName, txIpcQueueName)
+        # Incoming packets are queued as raw (header, data) tuples, the
+        # CRTPPacket is only created when it is actually received
+        self.crtpCom.incomingCrtpPacket.add_callback(self._in_queue.put)
 
     def send_packet(self, pk):
         """Send a CRTP packet"""
@@ -112,24 +217,19 @@ class SimDriver(CRTPDriver):
         Receive a packet through the link. This call is blocking but will
         timeout and return None if a timeout is supplied.
         """
-        if wait == 0:
-            try:
-                return self._in_queue.get(False)
-            except queue.Empty:
-                return None
-        elif wait < 0:
-            try:
-                return self._in_queue.get(True)
-            except queue.Empty:
-                return None
-        else:
-            try:
-                return self._in_queue.get(True, wait)
-            except queue.Empty:
-                return None
+        # wait == 0 polls, wait < 0 blocks forever, wait > 0 is a timeout
+        try:
+            header, data = self._in_queue.get(wait != 0, wait if wait > 0 else None)
+        except queue.Empty:
+            return None
+        return CRTPPacket(header, data)
 
     def get_status(self):
-        return 'Simulation link driver version {}'.format(self.version)
+        status = 'Simulation link driver version {}'.format(self.version)
+        if self.crtpCom is not None:
+            # The link does not resend, so make packet loss visible
+            status += ', {} tx packets dropped'.format(self.crtpCom.getTxDroppedPackets())
+        return status
 
     def get_name(self):
         return 'Simulation link driver'
@@ -152,37 +252,71 @@ class SimDriver(CRTPDriver):
         self.crtpCom.endCommunication()
 
 
-class InterProcessPacket:
-    def __init__(self, port, payload):
-        self.port = port
-        self.payload = payload
+class SimulationIpc:
+    '''
+    CRTP packet handling shared by the IPC transports. A transport
+    implements sendCrtpPacketBytes and passes every packet it receives
+    to _handleIncomingCrtpPacket.
+    '''
+    def __init__(self):
+        self.incomingCrtpPacket = Caller()
+        self.incomingControlPacket = Caller()
+
+    def sendCrtpPacket(self, crtpPacket):
+        crtpPacketBytes = self.convertCRTPPacketObjectToBytearray(crtpPacket)
+        self.sendCrtpPacketBytes(crtpPacketBytes)
+
+    def sendCrtpPacketBytes(self, crtpPacketBytes):
+        raise NotImplementedError
+
+    def sendCrtpPacketRaw(self, channel, payload, port=0x09):
+        '''Create a CRTP packet from channel, payload and port and 
+           convert it to a bytearray for sending it via POSIX message
+           queue to another process.
+
+        params:
+        channel -> int: CRTP channel
+        payload -> bytearray: The payload for the CRTP packet
+        port -> int: CRTP port
+        '''
+        crtpPacket = self.createCRTPPacket(port, channel, payload)
+        crtpPacketBytes = self.convertCRTPPacketObjectToBytearray(crtpPacket)
+        self.sendCrtpPacketBytes(crtpPacketBytes)
+
+    def createCRTPPacket(self, port, channel, payload):
+        if isinstance(payload, int):
+            pk = CRTPPacket()
+            pk.data = _I_STRUCT.pack(payload)
+        else:
+            pk = CRTPPacket(data=payload)
 
-    def getPort(self):
-        return self.port
+        pk.set_header(port, channel)
+        return pk
 
-    def getPayload(self):
-        return self.payload
+    def convertCRTPPacketObjectToBytearray(self, crtp_packet):
+        # Packet size is the size of data payload, the receiver uses it
+        # to find the end of the packet so no padding is sent
+        return pack_crtp(crtp_packet.get_header(), crtp_packet._get_data())
 
-    def getBytes(self):
-        '''Requires payload to be already of type bytearray'''
-        if(type(self.payload) != bytearray):
-            print("ERROR InterProcessPacket: Payload needs to be of type bytearray.")
-            return None
-        packetBytes = bytearray()
+    def _handleIncomingCrtpPacket(self, crtpPacketBytes):
+        '''Pass the (header, data) tuple of the packet to incomingCrtpPacket,
+           use convertBytearrayToCRTPPacketObject if a CRTPPacket is needed'''
+        self.incomingCrtpPacket.call(unpack_crtp(crtpPacketBytes))
 
-        portBytes = struct.pack('<B', self.port)
-        packetBytes.extend(portBytes)
-        packetBytes.extend(self.payload)
-        return packetBytes
+    def convertBytearrayToCRTPPacketObject(self, crtpPacketBytes):
+        # Extract the header and data from the bytearray
+        # and save in a newly created CRTP packet
+        packet_header, packet_data = unpack_crtp(crtpPacketBytes)
+        return CRTPPacket(header=packet_header, data=packet_data)
 
 
-class SimulationIpcPosix():
+class SimulationIpcPosix(SimulationIpc):
     def __init__(self, rxQueueName, txQueueName):
-        self.incomingCrtpPacket = Caller()
-        self.incomingControlPacket = Caller()
+        SimulationIpc.__init__(self)
 
         self.rxQueueName = rxQueueName
         self.txQueueName = txQueueName
+        self.simCom = None
 
         # Inter-process communication (IPC) with POSIX message queues
         try:
@@ -206,89 +340,212 @@ class SimulationIpcPosix():
         '''Return the names of the rx and tx posix queues in this order'''
         return self.rxQueueName, self.txQueueName
 
+    def getTxDroppedPackets(self):
+        '''Return the number of packets dropped because the tx queue was full'''
+        if self.simCom is None:
+            # The queues could not be created
+            return 0
+        return self.simCom.txDroppedPackets
+
     def sendCrtpPacket(self, crtpPacket):
-        crtpPacketBytes = self.convertCRTPPacketObjectToBytearray(crtpPacket)
-        self.sendCrtpPacketBytes(crtpPacketBytes)
+        # Hot path, serialize the packet with its IPC port in one go and
+        # hand the result straight to the message queue
+        self.simCom.sendBytes(
+            pack_ipc_crtp(PORT_IPC_CRTP, crtpPacket.get_header(), crtpPacket._get_data()))
 
     def sendCrtpPacketBytes(self, crtpPacketBytes):
         ''' Send a CRTP packet via POSIX message queue
 
         params:
-        crtpPacketBytes -> bytearray: The CRTP packet of type bytearray
+        crtpPacketBytes -> bytes: The serialized CRTP packet
         '''
         self.simCom.send(PORT_IPC_CRTP, crtpPacketBytes)
 
-    def sendCrtpPacketRaw(self, channel, payload, port=0x09):
-        '''Create a CRTP packet from channel, payload and port and 
-           convert it to a bytearray for sending it via POSIX message
-           queue to another process.
+    def endCommunication(self):
+        self.simCom.endCommunication()
+        self.rxIpcQueue.unlink()
+        self.txIpcQueue.unlink()
+
+
+class SimulationIpcShm(SimulationIpc):
+    '''
+    Drop-in alternative to SimulationIpcPosix that exchanges CRTP packets
+    through shared memory rings instead of POSIX message queues. The packet
+    data is never copied through the kernel, a semaphore per direction is
+    only used to wake up the receiving side.
+
+    :param rxShmName: Name of the ring the simulation writes to
+    :param txShmName: Name of the ring the simulation reads from
+    '''
+    def __init__(self, rxShmName, txShmName):
+        SimulationIpc.__init__(self)
+
+        self.rxShmName = rxShmName
+        self.txShmName = txShmName
+        self.txDroppedPackets = 0
+
+        try:
+            self.rxRing = SharedMemoryRing(rxShmName)
+        except Exception as e:
+            logger.error('SimulationIpcShm: {} creation failed. {}'.format(rxShmName, e))
+            return
+
+        try:
+            self.txRing = SharedMemoryRing(txShmName)
+        except Exception as e:
+            logger.error('SimulationIpcShm: {} creation failed. {}'.format(txShmName, e))
+            return
+
+        self.rxData = True
+        self.rxThread = Thread(target=self._receiveShmPackets)
+        self.rxThread.start()
+
+    def getIpcQueueNames(self):
+        '''Return the names of the rx and tx shared memory rings in this order'''
+        return self.rxShmName, self.txShmName
+
+    def getTxDroppedPackets(self):
+        '''Return the number of packets dropped because the tx ring was full'''
+        return self.txDroppedPackets
+
+    def sendCrtpPacketBytes(self, crtpPacketBytes):
+        ''' Send a CRTP packet via the shared memory ring
 
         params:
-        channel -> int: CRTP channel
-        payload -> bytearray: The payload for the CRTP packet
-        port -> int: CRTP port
+        crtpPacketBytes -> bytes: The serialized CRTP packet
         '''
-        crtpPacket = self.createCRTPPacket(port, channel, payload)
-        crtpPacketBytes = self.convertCRTPPacketObjectToBytearray(crtpPacket)
-        self.sendCrtpPacket(crtpPacketBytes)
+        if not self.txRing.put(crtpPacketBytes):
+            self.txDroppedPackets += 1
+            logger.debug('Shared memory ring {} full, oldest packet dropped'.format(self.txShmName))
+
+    def _receiveShmPackets(self):
+        _configureRxThread()
+        busyPollNs = _busyPollNs()
+        while self.rxData:
+            ready = False
+            if busyPollNs:
+                # Spin on the ring for a while before blocking
+                deadline = time.monotonic_ns() + busyPollNs
+                while not ready and self.rxData and time.monotonic_ns() < deadline:
+                    ready = not self.rxRing.empty()
+
+            if not ready:
+                # Wait for the simulation to signal new packets,
+                # endCommunication posts the semaphore to end the wait
+                self.rxRing.semaphore.acquire()
+
+            # The producer posts once per packet, consume the posts of
+            # the packets drained below so a burst wakes us up once.
+            # Posts for packets written after this stay pending.
+            self.rxRing.clearWakeups()
+
+            # Drain the whole ring
+            crtpPacketBytes = self.rxRing.get()
+            while crtpPacketBytes is not None:
+                try:
+                    self._handleIncomingCrtpPacket(crtpPacketBytes)
+                except Exception:
+                    # Keep the rx thread alive if a callback fails
+                    logger.exception('Error handling packet from {}'.format(self.rxShmName))
+                crtpPacketBytes = self.rxRing.get()
 
-    def createCRTPPacket(self, port, channel, payload):
-        if isinstance(payload, int):
-            pk = CRTPPacket()
-            pk.data = struct.pack('<I', payload)
-        else:
-            pk = CRTPPacket(data=payload)
+    def endCommunication(self):
+        self.rxData = False
+        self.rxRing.semaphore.release()
+        self.rxThread.join()
+        self.rxRing.unlink()
+        self.txRing.unlink()
 
-        pk.set_header(port, channel)
-        return pk
 
-    def convertCRTPPacketObjectToBytearray(self, crtp_packet):
-        MAX_PAYLOAD = 30
-        packet = bytearray()
-        padding = bytearray()
-
-        # Packet size is the size of data payload
-        packet_size    = crtp_packet.get_data_size()
-        packet_data    = crtp_packet._get_data()
-        packet_header  = crtp_packet.get_header()
-
-        header = struct.pack('<B', packet_header )
-        size   = struct.pack('<B', packet_size)
-        for i in range(MAX_PAYLOAD - packet_size):
-            padding.extend(bytes(0x1))
-
-        packet.extend(size)
-        packet.extend(header)
-        packet.extend(packet_data)
-        packet.extend(padding)
-        return packet
+class SharedMemoryRing:
+    '''
+    Single producer, single consumer ring of fixed size CRTP slots in a POSIX
+    shared memory segment, with a semaphore named like the segment plus "sem"
+    to wake up the consumer.
 
-    def _handleIncomingCrtpPacket(self, crtpPacketBytes):
-        crtpPacket = self.convertBytearrayToCRTPPacketObject(crtpPacketBytes)
-        self.incomingCrtpPacket.call(crtpPacket)
+    Layout: head(uint32) | tail(uint32) | slot[0] | slot[1] | ...
+    Only the consumer advances head and only the producer advances tail,
+    so no lock is needed between the two processes.
+    '''
+    SHM_SIZE = 4096
+    SLOT_SIZE = 32
+    _INDICES = struct.Struct('<II')
+    _INDEX = struct.Struct('<I')
+
+    def __init__(self, name):
+        self.name = name
+        self.memory = posix_ipc.SharedMemory(name, flags=posix_ipc.O_CREAT, size=self.SHM_SIZE)
+        self.buffer = mmap.mmap(self.memory.fd, self.SHM_SIZE)
+        self.memory.close_fd()
+        self.semaphore = posix_ipc.Semaphore(name + "sem", flags=posix_ipc.O_CREAT)
+        self.slots = (self.SHM_SIZE - self._INDICES.size) // self.SLOT_SIZE
+
+    def put(self, packetBytes):
+        '''Write one packet to the ring. If the ring is full the oldest
+        packet is dropped to make room, False is returned in that case'''
+        if len(packetBytes) > self.SLOT_SIZE:
+            raise ValueError('Packet of {} bytes does not fit a {} byte slot'
+                             .format(len(packetBytes), self.SLOT_SIZE))
+
+        head, tail = self._INDICES.unpack_from(self.buffer, 0)
+        nextTail = (tail + 1) % self.slots
+        dropped = nextTail == head
+        if dropped:
+            # Same policy as the message queue, the newest packets are
+            # the relevant ones. The producer advancing head races with
+            # a concurrent get, at worst the oldest packet is delivered
+            # once more or one more packet is lost.
+            self._INDEX.pack_into(self.buffer, 0, (head + 1) % self.slots)
+
+        offset = self._INDICES.size + tail * self.SLOT_SIZE
+        self.buffer[offset:offset + len(packetBytes)] = packetBytes
+        self._INDEX.pack_into(self.buffer, 4, nextTail)
+        self.semaphore.release()
+        return not dropped
+
+    def get(self):
+        '''Read one packet from the ring, returns None if the ring is empty'''
+        head, tail = self._INDICES.unpack_from(self.buffer, 0)
+        if head == tail:
+            return None
 
-    def convertBytearrayToCRTPPacketObject(self, crtpPacketBytes):
-        # Extract the header, size and data from the bytearray
-        # and save in a newly created CRTP packet
-        packet_size   = struct.unpack('<B', crtpPacketBytes[:1])
-        packet_header = struct.unpack('<B', crtpPacketBytes[1:2])
-        crtp_packet   = CRTPPacket(header=packet_header[0], data=crtpPacketBytes[2:(packet_size[0]+2)])
+        offset = self._INDICES.size + head * self.SLOT_SIZE
+        packetBytes = self.buffer[offset:offset + self.SLOT_SIZE]
+        self._INDEX.pack_into(self.buffer, 0, (head + 1) % self.slots)
+        return packetBytes
 
-        return crtp_packet
+    def empty(self):
+        '''Return True if there is no packet to read'''
+        head, tail = self._INDICES.unpack_from(self.buffer, 0)
+        return head == tail
 
-    def endCommunication(self):
-        self.simCom.endCommunication()
-        self.rxIpcQueue.unlink()
-        self.txIpcQueue.unlink()
+    def clearWakeups(self):
+        '''Consume all pending posts of the semaphore without blocking'''
+        try:
+            while True:
+                self.semaphore.acquire(0)
+        except posix_ipc.BusyError:
+            pass
+
+    def close(self):
+        '''Release the mapping and the semaphore of this process, the ring
+        itself is kept for the other side'''
+        self.buffer.close()
+        self.semaphore.close()
+
+    def unlink(self):
+        self.memory.unlink()
+        self.semaphore.unlink()
+        self.close()
 
 
 class InterProcessCommunicatorPosix:
     '''
-    Inter process communication. Uses the InterProcessPacket to
-    send and receive data on user-defined ports.
+    Inter process communication. Prefixes the payload with a port
+    byte to send and receive data on user-defined ports.
 
-    :param txQueue: multiprocessing.Queue for transmitting data
-    :param rxQueue: multiprocessing.Queue for receiving data
+    :param txQueue: posix_ipc.MessageQueue for transmitting data
+    :param rxQueue: posix_ipc.MessageQueue for receiving data
 
     Remember, the txQueue of the first process is the rxQueue
     of the second process and vice versa.
@@ -297,85 +554,121 @@ class InterProcessCommunicatorPosix:
         self.txQueue = txQueue
         self.rxQueue = rxQueue
 
-        self.txThreadQueue = Queue()
+        # Sending never blocks the caller, see send()
+        self.txQueue.block = False
+        self.txDroppedPackets = 0
 
-        # The port is the key associated to a
-        # list of registered callback functions
+        # The port is the key associated to a tuple of registered
+        # callback functions. The tuples are replaced, never modified,
+        # so the rx thread can iterate them without taking a copy.
         self.portCallbacks = {}
 
+        # On Linux the message queue descriptor is a file descriptor, so
+        # the rx thread can wait on it and then drain it non-blocking
+        self.rxQueue.block = False
+        self.rxSelector = selectors.DefaultSelector()
+        self.rxSelector.register(self.rxQueue.mqd, selectors.EVENT_READ)
+
         self.rxData = True
         self.rxThread = Thread(target = self._receiveIpcPacket)
-        self.txData = True
-        self.txThread = Thread(target=self._sendIpcPacket)
         self.rxThread.start()
-        self.txThread.start()
 
     def _receiveIpcPacket(self):
+        _configureRxThread()
+        busyPollNs = _busyPollNs()
         while(self.rxData):
-            try:
-                # Wait for a packet to arrive
-                ipcPacketBytes = self.rxQueue.receive(timeout=0.1)
-
-                # ipcPacketPrio = ipcPacketBytes[1]
-                # print(f"Packet prio: {ipcPacketPrio}")
-                ipcPacketPort = struct.unpack('<B', ipcPacketBytes[0][:1])[0]
-                # print(f"ipcPacketBytes: {ipcPacketBytes}")
-                # print(f"crtpBytes: {ipcPacketBytes[0][1:]}")
-
-                self._invokePortCallbacks(ipcPacketPort, ipcPacketBytes[0][1:])
-            except:
-                pass
+            ipcPackets = []
+            if busyPollNs:
+                # Spin on the queue for a while before blocking
+                deadline = time.monotonic_ns() + busyPollNs
+                while not ipcPackets and time.monotonic_ns() < deadline:
+                    try:
+                        ipcPackets.append(self.rxQueue.receive())
+                    except posix_ipc.BusyError:
+                        pass
+
+            if not ipcPackets:
+                # Wait for a packet to arrive, endCommunication
+                # sends a wakeup packet to end the wait
+                self.rxSelector.select()
+
+            # Drain whatever else is already queued, so a burst
+            # costs one wakeup instead of one per packet
+            while True:
+                try:
+                    ipcPackets.append(self.rxQueue.receive())
+                except posix_ipc.BusyError:
+                    break
+
+            for ipcPacketBytes, _ in ipcPackets:
+                try:
+                    # The first byte is the port, pass the rest without copying
+                    self._invokePortCallbacks(ipcPacketBytes[0], memoryview(ipcPacketBytes)[1:])
+                except Exception:
+                    # Keep the rx thread alive if a callback fails
+                    logger.exception('Error handling packet from {}'.format(self.rxQueue.name))
 
     def addPortCallback(self, port, cb):
         ''' Add a callback function for receiving data on the specified port
 
-        :param port: Port on which the InterProcessPacket arrives
+        :param port: Port on which the data arrives
         :param cb: Callback function to be called when data arrives.
                    The function needs to take one parameter for
                    accepting the payload.
         '''
-        # Check if the callback is already registered on the port
-        if port in self.portCallbacks:
-            for currentCb in self.portCallbacks.items():
-                # Do not register duplicates
-                if currentCb is cb:
-                    return
-        # If there are no callbacks on the port, initialize the port
-        if port not in self.portCallbacks:
-            self.portCallbacks[port] = []
-
-        # Finally register the callback
-        self.portCallbacks[port].append(cb)
+        callbacks = self.portCallbacks.get(port, ())
+        # Do not register duplicates
+        if cb in callbacks:
+            return
+        self.portCallbacks[port] = callbacks + (cb,)
 
     def _invokePortCallbacks(self, port, payload):
         """ Call the registered callbacks """
-        if port not in self.portCallbacks:
-            return
-        copyOfCallbacks = list(self.portCallbacks[port])
-        for cb in copyOfCallbacks:
+        for cb in self.portCallbacks.get(port, ()):
             cb(payload)
 
     def removePortCallback(self, port, cb):
-        # Check if the callback is registered on the port
-        if port in cb:
-            for currentCb in self.portCallbacks.items():
-                # Remove the callback from the list
-                if currentCb is cb:
-                    self.portCallbacks.remove(cb)
+        ''' Remove a callback function registered on the specified port '''
+        callbacks = self.portCallbacks.get(port, ())
+        if cb in callbacks:
+            # Compare with == like the membership test, bound methods are
+            # new objects on every attribute access so `is` never matches
+            self.portCallbacks[port] = tuple(c for c in callbacks if c != cb)
 
     def send(self, port, payload):
-        ipcPacket = InterProcessPacket(port, payload)
-        self.txThreadQueue.put(ipcPacket)
+        self.sendBytes(bytes((port,)) + payload)
+
+    def sendBytes(self, ipcPacketBytes):
+        ''' Send a packet that already starts with its port byte '''
+        try:
+            self.txQueue.send(ipcPacketBytes)
+            return
+        except posix_ipc.BusyError:
+            pass
 
-    def _sendIpcPacket(self):
-        while(self.txData):
-            try:
-                ipcPacket = self.txThreadQueue.get(block=True, timeout=0.1)
-                self.txQueue.send(ipcPacket.getBytes())
-            except:
-                pass
+        # The queue is full because the other process is not keeping
+        # up. Drop the oldest packet so the newest one gets through.
+        try:
+            self.txQueue.receive()
+            self.txDroppedPackets += 1
+            logger.debug('IPC queue {} full, oldest packet dropped ({} in total)'
+                         .format(self.txQueue.name, self.txDroppedPackets))
+        except posix_ipc.BusyError:
+            # The other process emptied the queue in the meantime
+            pass
+        try:
+            self.txQueue.send(ipcPacketBytes)
+        except posix_ipc.BusyError:
+            self.txDroppedPackets += 1
+            logger.warning('IPC queue {} full, packet dropped'.format(self.txQueue.name))
 
     def endCommunication(self):
         self.rxData = False
-        self.txData = False
+        try:
+            self.rxQueue.send(bytes((PORT_IPC_WAKEUP,)))
+        except posix_ipc.BusyError:
+            # The queue is full, so the rx thread is awake anyway
+            pass
+        self.rxThread.join()
+        self.rxSelector.close()
         return self.rxThread
@@ -1,8 +1,19 @@
 #!/usr/bin/env python3
 from pathlib import Path
 
+from setuptools import Extension
 from setuptools import find_packages
 from setuptools import setup
+
+# The compiled sim driver codec is optional, cflib.crtp.simdriver falls back
+# to pure Python if Cython is missing or the extension fails to compile.
+# pip installs Cython for the build, see the build-system in pyproject.toml
+try:
+    import Cython  # noqa: F401, setuptools builds .pyx sources with it
+    ext_modules = [Extension('cflib.crtp._simcodec', ['cflib/crtp/_simcodec.pyx'], optional=True)]
+except ImportError:
+    ext_modules = []
+
 # read the contents of README.md file fo use in pypi description
 directory = Path(__file__).parent
 long_description = (directory / 'README.md').read_text()
@@ -11,6 +22,7 @@ setup(
     name='cflib',
     version='0.1.24',
     packages=find_packages(exclude=['examples', 'test']),
+    ext_modules=ext_modules,
 
     description='Crazyflie python driver',
     url='https://github.com/bitcraze/crazyflie-lib-python',
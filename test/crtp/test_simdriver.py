@@ -0,0 +1,605 @@
+# -*- coding: utf-8 -*-
+#
+#     ||          ____  _ __
+#  +------+      / __ )(_) /_______________ _____  ___
+#  | 0xBC |     / __  / / __/ ___/ ___/ __ `/_  / / _ \
+#  +------+    / /_/ / / /_/ /__/ /  / /_/ / / /_/  __/
+#   ||  ||    /_____/_/\__/\___/_/   \__,_/ /___/\___/
+#
+#  Copyright (C) Bitcraze AB
+#
+#  Crazyflie Nano Quadcopter Client
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <https://www.gnu.org/licenses/>.
+import os
+import unittest
+import unittest.mock
+from threading import Event
+from threading import Timer
+
+import posix_ipc
+
+from cflib.crtp.simdriver import _pack_crtp_python
+from cflib.crtp.simdriver import _pack_ipc_crtp_python
+from cflib.crtp.simdriver import _unpack_crtp_python
+from cflib.crtp.simdriver import PORT_IPC_CRTP
+from cflib.crtp.simdriver import PORT_IPC_WAKEUP
+from cflib.crtp.simdriver import SharedMemoryRing
+from cflib.crtp.simdriver import SimDriver
+from cflib.crtp.simdriver import SimulationIpcPosix
+from cflib.crtp.simdriver import SimulationIpcShm
+
+try:
+    from cflib.crtp import _simcodec
+except ImportError:
+    _simcodec = None
+
+
+class CrtpCodecTest(unittest.TestCase):
+
+    def test_that_python_codec_round_trips(self):
+        # Fixture
+        data = bytearray(b'abc')
+
+        # Test
+        packet = _pack_crtp_python(0x5d, data)
+        actual = _unpack_crtp_python(memoryview(packet))
+
+        # Assert
+        self.assertEqual(b'\x03\x5dabc', packet)
+        self.assertEqual((0x5d, b'abc'), actual)
+
+    def test_that_python_codec_prefixes_ipc_port(self):
+        # Fixture
+        data = bytearray(b'abc')
+
+        # Test
+        actual = _pack_ipc_crtp_python(PORT_IPC_CRTP, 0x5d, data)
+
+        # Assert
+        self.assertEqual(b'\x00\x03\x5dabc', actual)
+        self.assertEqual(b'\x03\x5dabc', _pack_crtp_python(0x5d, data))
+
+    def test_that_python_codec_rejects_values_that_do_not_fit_a_byte(self):
+        # Fixture
+
+        # Test
+        # Assert
+        with self.assertRaises(ValueError):
+            _pack_crtp_python(0x13c, b'abc')
+        with self.assertRaises(ValueError):
+            _pack_crtp_python(-1, b'abc')
+        with self.assertRaises(ValueError):
+            _pack_crtp_python(0x5d, bytes(300))
+        with self.assertRaises(ValueError):
+            _pack_ipc_crtp_python(0x100, 0x5d, b'abc')
+
+    @unittest.skipIf(_simcodec is None, 'compiled codec is not built')
+    def test_that_compiled_codec_rejects_values_that_do_not_fit_a_byte(self):
+        # Fixture
+
+        # Test
+        # Assert
+        with self.assertRaises(ValueError):
+            _simcodec.pack_crtp(0x13c, b'abc')
+        with self.assertRaises(ValueError):
+            _simcodec.pack_crtp(-1, b'abc')
+        with self.assertRaises(ValueError):
+            _simcodec.pack_crtp(0x5d, bytes(300))
+        with self.assertRaises(ValueError):
+            _simcodec.pack_ipc_crtp(0x100, 0x5d, b'abc')
+
+    @unittest.skipIf(_simcodec is None, 'compiled codec is not built')
+    def test_that_compiled_codec_matches_python_codec(self):
+        # Fixture
+        payloads = [bytes(range(size)) for size in range(31)]
+
+        for data in payloads:
+            # Test
+            packet = _simcodec.pack_crtp(0x5d, bytearray(data))
+
+            # Assert
+            self.assertEqual(_pack_crtp_python(0x5d, bytearray(data)), packet)
+            self.assertEqual(_pack_ipc_crtp_python(0xfe, 0x5d, bytearray(data)),
+                             _simcodec.pack_ipc_crtp(0xfe, 0x5d, bytearray(data)))
+            self.assertEqual(_unpack_crtp_python(packet), _simcodec.unpack_crtp(packet))
+            self.assertEqual(_unpack_crtp_python(memoryview(packet)),
+                             _simcodec.unpack_crtp(memoryview(packet)))
+
+    @unittest.skipIf(_simcodec is None, 'compiled codec is not built')
+    def test_that_compiled_codec_matches_python_codec_for_truncated_packet(self):
+        # Fixture
+        packet = b'\x09\x5dab'
+
+        # Test
+        actual = _simcodec.unpack_crtp(packet)
+
+        # Assert
+        self.assertEqual(_unpack_crtp_python(packet), actual)
+
+
+class SimDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SimDriver()
+
+    def test_that_scan_returns_uri_of_known_address(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.scan_interface(0xE7E7E7E703)
+
+        # Assert
+        self.assertEqual([['radio://0/80/2M/E7E7E7E703', '']], actual)
+
+    def test_that_scan_of_unknown_address_returns_nothing(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.scan_interface(0xE7E7E7E7FF)
+
+        # Assert
+        self.assertEqual([], actual)
+
+    def test_that_status_is_reported_when_queue_creation_failed(self):
+        # Fixture
+        # A slash inside the queue name is invalid
+        self.sut.connect('test://x/', None, None)
+
+        # Test
+        actual = self.sut.get_status()
+
+        # Assert
+        self.assertIn('0 tx packets dropped', actual)
+
+
+class SimDriverReceiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SimDriver()
+        self.sut.connect('test://T1', None, None)
+        self.peer = posix_ipc.MessageQueue('/rxsimcrtpmqT1')
+
+    def tearDown(self):
+        self.sut.close()
+        self.peer.close()
+
+    def test_that_received_packet_is_built_from_ipc_packet(self):
+        # Fixture
+        self.peer.send(b'\x00\x03\x5dabc')
+
+        # Test
+        actual = self.sut.receive_packet(5)
+
+        # Assert
+        self.assertEqual(5, actual.port)
+        self.assertEqual(1, actual.channel)
+        self.assertEqual(bytearray(b'abc'), actual.data)
+
+    def test_that_receive_without_wait_returns_none_when_empty(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.receive_packet(0)
+
+        # Assert
+        self.assertIsNone(actual)
+
+    def test_that_receive_with_timeout_returns_none_when_empty(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.receive_packet(0.01)
+
+        # Assert
+        self.assertIsNone(actual)
+
+    def test_that_receive_with_negative_wait_blocks_until_packet_arrives(self):
+        # Fixture
+        sender = Timer(0.05, self.peer.send, (b'\x00\x01\x5da',))
+        sender.start()
+
+        # Test
+        actual = self.sut.receive_packet(-1)
+
+        # Assert
+        sender.join()
+        self.assertEqual(bytearray(b'a'), actual.data)
+
+
+class SharedMemoryRingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SharedMemoryRing('/test_simdriver_ring')
+
+    def tearDown(self):
+        self.sut.unlink()
+
+    def test_that_empty_ring_returns_none(self):
+        # Fixture
+
+        # Test
+        actual = self.sut.get()
+
+        # Assert
+        self.assertIsNone(actual)
+
+    def test_that_packet_is_read_back(self):
+        # Fixture
+        packet = b'\x03\x5dabc'
+
+        # Test
+        self.sut.put(packet)
+        actual = self.sut.get()
+
+        # Assert
+        self.assertEqual(packet, actual[:len(packet)])
+        self.assertIsNone(self.sut.get())
+
+    def test_that_packets_are_read_in_order_across_wraparound(self):
+        # Fixture
+        count = self.sut.slots * 2 + 3
+
+        # Test
+        actual = []
+        for i in range(count):
+            self.assertTrue(self.sut.put(bytes((1, 0x5d, i & 0xff))))
+            actual.append(self.sut.get()[2])
+
+        # Assert
+        self.assertEqual([i & 0xff for i in range(count)], actual)
+
+    def test_that_put_on_full_ring_drops_oldest_packet(self):
+        # Fixture
+        for i in range(self.sut.slots - 1):
+            self.assertTrue(self.sut.put(bytes((1, 0x5d, i))))
+
+        # Test
+        actual = self.sut.put(b'\x01\x5dX')
+
+        # Assert
+        self.assertFalse(actual)
+        received = []
+        packet = self.sut.get()
+        while packet is not None:
+            received.append(packet[2])
+            packet = self.sut.get()
+        self.assertEqual(list(range(1, self.sut.slots - 1)) + [ord('X')], received)
+
+    def test_that_clear_wakeups_consumes_all_posts(self):
+        # Fixture
+        self.sut.put(b'\x01\x5da')
+        self.sut.put(b'\x01\x5db')
+
+        # Test
+        self.sut.clearWakeups()
+
+        # Assert
+        self.assertEqual(0, self.sut.semaphore.value)
+
+    def test_that_oversize_packet_is_rejected(self):
+        # Fixture
+        packet = bytes(SharedMemoryRing.SLOT_SIZE + 1)
+
+        # Test
+        # Assert
+        with self.assertRaises(ValueError):
+            self.sut.put(packet)
+        self.assertIsNone(self.sut.get())
+
+
+class SimulationIpcShmTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SimulationIpcShm('/test_simdriver_rx', '/test_simdriver_tx')
+        self.peer = SharedMemoryRing('/test_simdriver_rx')
+        self.received = []
+        self.all_received = Event()
+
+    def tearDown(self):
+        self.peer.close()
+
+    def test_that_end_communication_stops_rx_thread(self):
+        # Fixture
+
+        # Test
+        self.sut.endCommunication()
+
+        # Assert
+        self.assertFalse(self.sut.rxThread.is_alive())
+
+    def test_that_drop_on_full_tx_ring_is_counted(self):
+        # Fixture
+        for i in range(self.sut.txRing.slots - 1):
+            self.sut.sendCrtpPacketRaw(1, bytes((i,)), port=2)
+
+        # Test
+        self.sut.sendCrtpPacketRaw(1, b'X', port=2)
+
+        # Assert
+        self.sut.endCommunication()
+        self.assertEqual(1, self.sut.getTxDroppedPackets())
+
+    def test_that_failing_callback_does_not_stop_rx_thread(self):
+        # Fixture
+        self.sut.incomingCrtpPacket.add_callback(self._failing_callback)
+
+        # Test
+        self.peer.put(b'\x01\x5da')
+        self.peer.put(b'\x01\x5db')
+
+        # Assert
+        self.assertTrue(self.all_received.wait(5))
+        self.assertTrue(self.sut.rxThread.is_alive())
+        self.sut.endCommunication()
+        self.assertEqual([(0x5d, b'a'), (0x5d, b'b')], self.received)
+
+    def test_that_busy_polling_consumes_wakeups(self):
+        # Fixture
+        self.sut.endCommunication()
+        with unittest.mock.patch.dict(os.environ, {'SIMDRIVER_BUSY_POLL_US': '10000000'}):
+            self.sut = SimulationIpcShm('/test_simdriver_rx', '/test_simdriver_tx')
+        self.sut.incomingCrtpPacket.add_callback(self._counting_callback)
+        self.peer.close()
+        self.peer = SharedMemoryRing('/test_simdriver_rx')
+
+        # Test
+        self.peer.put(b'\x01\x5da')
+        self.peer.put(b'\x01\x5db')
+
+        # Assert
+        self.assertTrue(self.all_received.wait(5))
+        # Only the post of the last packet may still be pending
+        self.assertLessEqual(self.peer.semaphore.value, 1)
+        self.sut.endCommunication()
+
+    def _counting_callback(self, packet):
+        self.received.append(packet)
+        if len(self.received) == 2:
+            self.all_received.set()
+
+    def _failing_callback(self, packet):
+        self.received.append(packet)
+        if len(self.received) == 2:
+            self.all_received.set()
+        raise Exception('Callback failure')
+
+
+class SimulationIpcPosixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sut = SimulationIpcPosix('/test_simdriver_rxmq', '/test_simdriver_txmq')
+        self.peer = posix_ipc.MessageQueue('/test_simdriver_txmq')
+
+    def tearDown(self):
+        self.sut.endCommunication()
+        self.peer.close()
+
+    def test_that_oldest_packets_are_dropped_when_tx_queue_is_full(self):
+        # Fixture
+        sent = 13
+
+        # Test
+        for i in range(sent):
+            self.sut.sendCrtpPacketRaw(1, bytes((i,)), port=2)
+
+        # Assert
+        actual = []
+        while True:
+            try:
+                actual.append(self.peer.receive(0)[0][3])
+            except posix_ipc.BusyError:
+                break
+        self.assertEqual(list(range(sent - len(actual), sent)), actual)
+        self.assertEqual(sent - len(actual), self.sut.getTxDroppedPackets())
+
+    def test_that_drop_is_not_counted_when_queue_was_emptied_by_peer(self):
+        # Fixture
+        self.sut.simCom.txQueue = _QueueEmptiedByPeer(self.sut.simCom.txQueue)
+
+        # Test
+        self.sut.sendCrtpPacketRaw(1, b'a', port=2)
+
+        # Assert
+        self.assertEqual(0, self.sut.getTxDroppedPackets())
+        self.assertEqual(b'\x00\x01-a', self.peer.receive(0)[0])
+
+    def test_that_raw_int_payload_is_sent(self):
+        # Fixture
+
+        # Test
+        self.sut.sendCrtpPacketRaw(1, 7, port=2)
+
+        # Assert
+        actual, _ = self.peer.receive(0)
+        self.assertEqual(b'\x00\x04-\x07\x00\x00\x00', actual)
+
+    def test_that_raw_bytes_payload_is_sent(self):
+        # Fixture
+
+        # Test
+        self.sut.sendCrtpPacketRaw(1, b'abc', port=2)
+
+        # Assert
+        actual, _ = self.peer.receive(0)
+        self.assertEqual(b'\x00\x03-abc', actual)
+
+
+class _QueueEmptiedByPeer:
+    '''Reports a full queue once, as if the peer emptied it right after'''
+
+    def __init__(self, queue):
+        self.queue = queue
+        self.name = queue.name
+        self.full = True
+
+    def send(self, message):
+        if self.full:
+            self.full = False
+            raise posix_ipc.BusyError()
+        self.queue.send(message)
+
+    def receive(self):
+        raise posix_ipc.BusyError()
+
+
+class InterProcessCommunicatorPosixTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ipc = SimulationIpcPosix('/test_simdriver_rxmq', '/test_simdriver_txmq')
+        self.sut = self.ipc.simCom
+        self.peer = posix_ipc.MessageQueue('/test_simdriver_rxmq')
+        self.callback_count = 0
+        self.received = []
+        self.all_received = Event()
+        self.expected_count = 0
+
+    def tearDown(self):
+        self.ipc.endCommunication()
+        self.peer.close()
+
+    def test_that_payload_is_passed_to_port_callback_as_memoryview(self):
+        # Fixture
+        self.sut.addPortCallback(5, self._recording_callback)
+        self.expected_count = 1
+
+        # Test
+        self.peer.send(b'\x05abc')
+
+        # Assert
+        self.assertTrue(self.all_received.wait(5))
+        payload = self.received[0]
+        self.assertIsInstance(payload, memoryview)
+        self.assertEqual(b'abc', bytes(payload))
+
+    def test_that_packets_queued_while_handling_are_all_received_in_order(self):
+        # Fixture
+        self.release = Event()
+        self.sut.addPortCallback(5, self._blocking_callback)
+        self.expected_count = 4
+        self.peer.send(b'\x05a')
+
+        # Test
+        for payload in (b'\x05b', b'\x05c', b'\x05d'):
+            self.peer.send(payload)
+        self.release.set()
+
+        # Assert
+        self.assertTrue(self.all_received.wait(5))
+        self.assertEqual([b'a', b'b', b'c', b'd'], self.received)
+
+    def test_that_wakeup_packet_does_not_stop_rx_thread_while_running(self):
+        # Fixture
+        self.sut.addPortCallback(5, self._recording_callback)
+        self.expected_count = 1
+
+        # Test
+        self.peer.send(bytes((PORT_IPC_WAKEUP,)))
+        self.peer.send(b'\x05a')
+
+        # Assert
+        self.assertTrue(self.all_received.wait(5))
+        self.assertTrue(self.sut.rxThread.is_alive())
+        self.assertEqual([b'a'], [bytes(payload) for payload in self.received])
+
+    def test_that_end_communication_wakes_up_and_stops_rx_thread(self):
+        # Fixture
+
+        # Test
+        self.sut.endCommunication()
+
+        # Assert
+        self.assertFalse(self.sut.rxThread.is_alive())
+
+    def test_that_bound_method_callback_is_added_only_one_time(self):
+        # Fixture
+
+        # Test
+        self.sut.addPortCallback(5, self._callback)
+        self.sut.addPortCallback(5, self._callback)
+
+        # Assert
+        self.sut._invokePortCallbacks(5, b'')
+        self.assertEqual(1, self.callback_count)
+
+    def test_that_callbacks_are_kept_per_port(self):
+        # Fixture
+        self.sut.addPortCallback(5, self._callback)
+
+        # Test
+        self.sut.addPortCallback(6, self._callback)
+
+        # Assert
+        self.sut._invokePortCallbacks(5, b'')
+        self.sut._invokePortCallbacks(6, b'')
+        self.assertEqual(2, self.callback_count)
+
+    def test_that_only_the_removed_callback_is_removed(self):
+        # Fixture
+        self.sut.addPortCallback(5, self._callback)
+        self.sut.addPortCallback(5, self._other_callback)
+
+        # Test
+        self.sut.removePortCallback(5, self._other_callback)
+
+        # Assert
+        self.sut._invokePortCallbacks(5, b'')
+        self.assertEqual(1, self.callback_count)
+
+    def test_that_removing_unregistered_callback_does_nothing(self):
+        # Fixture
+        self.sut.addPortCallback(5, self._callback)
+
+        # Test
+        self.sut.removePortCallback(5, self._other_callback)
+        self.sut.removePortCallback(7, self._callback)
+
+        # Assert
+        self.sut._invokePortCallbacks(5, b'')
+        self.assertEqual(1, self.callback_count)
+
+    def test_that_bound_method_callback_is_removed(self):
+        # Fixture
+        self.sut.addPortCallback(5, self._callback)
+
+        # Test
+        self.sut.removePortCallback(5, self._callback)
+
+        # Assert
+        self.sut._invokePortCallbacks(5, b'')
+        self.assertEqual(0, self.callback_count)
+        self.assertEqual((), self.sut.portCallbacks[5])
+
+    def test_that_crtp_handler_is_removed(self):
+        # Fixture
+
+        # Test
+        self.sut.removePortCallback(PORT_IPC_CRTP, self.ipc._handleIncomingCrtpPacket)
+
+        # Assert
+        self.assertEqual((), self.sut.portCallbacks[PORT_IPC_CRTP])
+
+    def _callback(self, payload):
+        self.callback_count += 1
+
+    def _other_callback(self, payload):
+        self.callback_count += 10
+
+    def _recording_callback(self, payload):
+        self.received.append(payload)
+        if len(self.received) == self.expected_count:
+            self.all_received.set()
+
+    def _blocking_callback(self, payload):
+        self.release.wait(5)
+        self._recording_callback(bytes(payload))